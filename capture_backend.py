@@ -0,0 +1,43 @@
+"""
+Screen capture backends: DXGI Desktop Duplication on Windows, mss everywhere else
+"""
+
+# Try to import dxcam for DXGI Desktop Duplication capture (Windows only)
+try:
+    import dxcam
+    DXCAM_AVAILABLE = True
+except ImportError:
+    DXCAM_AVAILABLE = False
+
+class CapturedFrame:
+    """Minimal stand-in for mss's ScreenShot: BGRA pixels in raw plus the frame size"""
+    
+    def __init__(self, bgra):
+        self.height, self.width = bgra.shape[:2]
+        self.size = (self.width, self.height)
+        self.raw = memoryview(bgra.reshape(-1))
+
+class DXGICapturer:
+    """Desktop Duplication capture, only does work when the screen actually changed"""
+    
+    def __init__(self, output_idx):
+        self.camera = dxcam.create(output_idx=output_idx, output_color='BGRA')
+    
+    @classmethod
+    def for_monitor(cls, monitor_idx):
+        """Capturer for an mss monitor index, None if DXGI can't be used for it"""
+        # mss monitor 0 is the whole virtual screen, DXGI only duplicates single outputs
+        if not DXCAM_AVAILABLE or monitor_idx < 1:
+            return None
+        try:
+            return cls(monitor_idx - 1)
+        except Exception as e:
+            print(f"DXGI capture unavailable, using mss: {e}")
+            return None
+    
+    def grab(self):
+        """Latest frame, None while the desktop is unchanged"""
+        frame = self.camera.grab()
+        if frame is None:
+            return None
+        return CapturedFrame(frame)
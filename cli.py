@@ -1,4 +1,5 @@
 from transport import get_transport
+from raw_transport import RawSocketProtocol
 from twisted.internet import reactor
 import argparse
 import sys
@@ -10,8 +11,11 @@ parser.add_argument('--port', type=int, default=5005, help='Which port to use wh
 parser.add_argument('--raw-sockets', action='store_true', default=True, help='Use raw sockets for maximum performance (default: True)')
 parser.add_argument('--twisted', action='store_true', help='Use Twisted reactor instead of raw sockets')
 parser.add_argument('--pyqt5', action='store_true', help='Use PyQt5 interface instead of tkinter (modern UI)')
+parser.add_argument('--io-cpu', type=int, help='Linux, raw sockets: pin the network thread to this CPU. Pick the CPU your NIC delivers RX interrupts on (see /proc/interrupts, ethtool -X)')
 parsed = parser.parse_args()
 
+RawSocketProtocol.io_cpu = parsed.io_cpu
+
 controller = parsed.mode == 'controller'
 
 # Determine transport type
@@ -1,3 +1,5 @@
+import struct
+
 VAR_SCALE = 'scale'
 VAR_SCALE_DEFAULT = 1.0  # Full resolution by default
 VAR_MONITOR = 'monitor'
@@ -16,8 +18,29 @@ VAR_USE_DELTA = 'use_delta'
 VAR_USE_DELTA_DEFAULT = True  # Use delta encoding for better FPS
 VAR_USE_RAW_SOCKETS = 'use_raw_sockets'
 VAR_USE_RAW_SOCKETS_DEFAULT = True
+VAR_USE_H264 = 'use_h264'
+VAR_USE_H264_DEFAULT = False  # Needs PyAV on both sides
+VAR_USE_LZ4 = 'use_lz4'
+VAR_USE_LZ4_DEFAULT = False  # Controller turns this on when it can decode LZ4
+VAR_RESTART_STREAM = 'restart_stream'  # Not a setting: the controller fell behind, next frame must be self-contained
 
 COMMAND_SET_VAR = 'set_var'
 COMMAND_SEND_SCREENSHOT = 'send_screenshot'
 COMMAND_NEW_COMMAND = 'command'
-COMMAND_SCROLL = 'scroll'
\ No newline at end of file
+COMMAND_SCROLL = 'scroll'
+COMMAND_TAG_LENGTH = 7  # Leading bytes that tell the commands above apart
+# Encoded once, they prefix every frame request and input event
+COMMAND_SEND_SCREENSHOT_BYTES = COMMAND_SEND_SCREENSHOT.encode('ascii')
+COMMAND_SET_VAR_BYTES = COMMAND_SET_VAR.encode('ascii')
+COMMAND_NEW_COMMAND_BYTES = COMMAND_NEW_COMMAND.encode('ascii')
+
+# Numpy frame header: height, width, channels, codec
+NUMPY_HEADER_FORMAT = '<IIIB'
+NUMPY_HEADER = struct.Struct(NUMPY_HEADER_FORMAT)  # Compiled once, not per frame
+NUMPY_CODEC_RAW = 0
+NUMPY_CODEC_ZLIB = 1  # Continues the raw deflate stream of the previous frame
+NUMPY_CODEC_ZLIB_RESET = 2  # First frame of a new raw deflate stream
+NUMPY_CODEC_LZ4 = 3  # Self-contained LZ4 block
+
+# Changed region of a delta frame: left, top, right, bottom
+BBOX_HEADER = struct.Struct('<IIII')
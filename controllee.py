@@ -4,15 +4,18 @@ from mss import mss
 import io
 import PIL
 import PIL.Image
+import PIL.ImageChops
 import json
 from constants import *
 import commands
 import threading
 import numpy as np
 import zlib
-import struct
 import time
 
+# Delta regions below this many RGB bytes are sent raw, WebP overhead outweighs the savings
+RAW_DELTA_MAX_BYTES = 512
+
 class ControlleeProtocol(ProtocolBase):
     def __init__(self):
         ProtocolBase.__init__(self)
@@ -23,6 +26,8 @@ class ControlleeProtocol(ProtocolBase):
         self.screenshot_lock = threading.Lock()
         self.is_processing_screenshot = False
         self.last_image = None  # For delta encoding
+        self.zlibStream = None  # Deflate stream reused across numpy frames
+        self.zlibStreamLevel = None
 
         self.setVariable(VAR_SCALE, VAR_SCALE_DEFAULT, False)
         self.setVariable(VAR_MONITOR, VAR_MONITOR_DEFAULT, False)
@@ -103,7 +108,7 @@ class ControlleeProtocol(ProtocolBase):
             ss = sct.grab(sct.monitors[monitorRequest])
             
             # Convert directly to numpy with optimized view operations
-            img_array = np.frombuffer(ss.bgra, dtype=np.uint8).reshape((ss.height, ss.width, 4))
+            img_array = np.frombuffer(ss.raw, dtype=np.uint8).reshape((ss.height, ss.width, 4))
             
             # Ultra-fast BGR to RGB conversion using slicing (no copying)
             rgb_array = img_array[:, :, [2, 1, 0]]  # BGR to RGB, drop alpha
@@ -119,18 +124,22 @@ class ControlleeProtocol(ProtocolBase):
             # Adaptive compression based on FPS target
             fps_target = self.config.get(VAR_FPS, VAR_FPS_DEFAULT)
             if fps_target > 100:
-                # Ultra-high FPS: minimal compression for speed
-                compression_level = 1
                 # Send raw data for maximum speed at very high FPS
-                header = struct.pack('<III', rgb_array.shape[0], rgb_array.shape[1], rgb_array.shape[2])
+                header = NUMPY_HEADER.pack(*rgb_array.shape, NUMPY_CODEC_RAW)
                 array_bytes = rgb_array.tobytes()
                 message_data = b'NUMPY' + header + array_bytes  # No compression for ultra-high FPS
             else:
-                # High FPS: balanced compression
+                # High FPS: balanced compression, reusing one deflate stream across frames
                 compression_level = self.config.get(VAR_COMPRESSION_LEVEL, VAR_COMPRESSION_LEVEL_DEFAULT)
-                header = struct.pack('<III', rgb_array.shape[0], rgb_array.shape[1], rgb_array.shape[2])
+                if self.zlibStream is None or self.zlibStreamLevel != compression_level:
+                    self.zlibStream = zlib.compressobj(compression_level, zlib.DEFLATED, -15, 8, zlib.Z_RLE)
+                    self.zlibStreamLevel = compression_level
+                    codec = NUMPY_CODEC_ZLIB_RESET
+                else:
+                    codec = NUMPY_CODEC_ZLIB
+                header = NUMPY_HEADER.pack(*rgb_array.shape, codec)
                 array_bytes = rgb_array.tobytes()
-                compressed_data = zlib.compress(array_bytes, compression_level)
+                compressed_data = self.zlibStream.compress(array_bytes) + self.zlibStream.flush(zlib.Z_SYNC_FLUSH)
                 message_data = b'NUMPY' + header + compressed_data
             
             self.writeMessage(message_data)
@@ -144,7 +153,7 @@ class ControlleeProtocol(ProtocolBase):
                 ss = sct.grab(sct.monitors[monitorRequest])
                 
                 # Ultra-fast PIL conversion
-                current_image = PIL.Image.frombytes('RGB', ss.size, ss.bgra, 'raw', 'BGRX')
+                current_image = PIL.Image.frombytes('RGB', ss.size, ss.raw, 'raw', 'BGRX')
                 
                 # Optimized scaling
                 if self.config[VAR_SCALE] < 1:
@@ -162,10 +171,15 @@ class ControlleeProtocol(ProtocolBase):
                         area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
                         if area < 50000:  # Small change area, send delta
                             region = current_image.crop(bbox)
-                            region.save(output, format="WebP", quality=95, method=0)
-                            region_data = output.getvalue()
-                            # Send delta: 'DELTA' + bbox + data
-                            delta_data = b'DELTA' + struct.pack('<IIII', bbox[0], bbox[1], bbox[2], bbox[3]) + region_data
+                            bbox_header = BBOX_HEADER.pack(bbox[0], bbox[1], bbox[2], bbox[3])
+                            if area * 3 <= RAW_DELTA_MAX_BYTES:
+                                # Tiny change (e.g. caret blink): send raw pixels, 'DELTR' + bbox + RGB
+                                delta_data = b'DELTR' + bbox_header + region.tobytes()
+                            else:
+                                region.save(output, format="WebP", quality=95, method=0)
+                                region_data = output.getvalue()
+                                # Send delta: 'DELTA' + bbox + data
+                                delta_data = b'DELTA' + bbox_header + region_data
                             self.writeMessage(delta_data)
                             self.last_image = current_image
                             return
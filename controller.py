@@ -7,9 +7,7 @@ from io import BytesIO
 from constants import *
 import json
 import time
-import numpy as np
 import zlib
-import struct
 
 class FactoryControllerBase:
     def __init__(self):
@@ -29,6 +27,8 @@ class ControllerProtocol(ProtocolBase):
         self.root.state('zoomed')
         self.root.protocol("WM_DELETE_WINDOW", self.onCloseClicked)
         self.lastReceivedTime = time.time()
+        self.zlibStream = None  # Matches the controllee's deflate stream
+        self.baseImage = None  # Last full frame, DELTA/DELTR regions are pasted onto it
         
         # Anti-flicker configurations
         self.root.configure(bg='black')
@@ -104,7 +104,7 @@ class ControllerProtocol(ProtocolBase):
         self.setValue(VAR_SHOULD_UPDATE_COMMANDS, self.updateVar.get())
     
     def setValue(self, variable, value):
-        toSend = COMMAND_SET_VAR.encode('ascii')
+        toSend = COMMAND_SET_VAR_BYTES
         toSend += json.dumps({
             'variable': variable,
             'value': value
@@ -112,7 +112,7 @@ class ControllerProtocol(ProtocolBase):
         self.writeMessage(toSend)
     
     def sendCommand(self, commandName, *args):
-        toSend = COMMAND_NEW_COMMAND.encode('ascii')
+        toSend = COMMAND_NEW_COMMAND_BYTES
         toSend += json.dumps([commandName, *args]).encode('ascii')
         self.writeMessage(toSend)
 
@@ -164,6 +164,8 @@ class ControllerProtocol(ProtocolBase):
             # Check if this is numpy data
             if data.startswith(b'NUMPY'):
                 self.processNumpyData(data[5:])  # Remove 'NUMPY' prefix
+            elif data.startswith(b'DELTA') or data.startswith(b'DELTR'):
+                self.processDeltaData(data)
             else:
                 self.processJPEGData(data)
             
@@ -174,44 +176,42 @@ class ControllerProtocol(ProtocolBase):
             self.lastReceivedTime = current_time
             
             # Request next screenshot immediately for maximum FPS
-            self.writeMessage(COMMAND_SEND_SCREENSHOT.encode('ascii'))
+            self.writeMessage(COMMAND_SEND_SCREENSHOT_BYTES)
         except Exception as e:
             print(f"Error processing image: {e}")
             # Request next screenshot even on error
-            self.writeMessage(COMMAND_SEND_SCREENSHOT.encode('ascii'))
+            self.writeMessage(COMMAND_SEND_SCREENSHOT_BYTES)
 
     def processNumpyData(self, data: bytes):
         """Process numpy array data (compressed or uncompressed)"""
         try:
-            # Read header (height, width, channels)
-            header_size = struct.calcsize('<III')
+            # Read header (height, width, channels, codec)
+            header_size = NUMPY_HEADER.size
             if len(data) < header_size:
                 return
             
-            height, width, channels = struct.unpack('<III', data[:header_size])
+            height, width, channels, codec = NUMPY_HEADER.unpack_from(data)
             payload_data = data[header_size:]
             
-            # Calculate expected size for uncompressed data
-            expected_size = height * width * channels
-            
-            # Determine if data is compressed or raw
-            if len(payload_data) == expected_size:
+            if codec == NUMPY_CODEC_RAW:
                 # Raw uncompressed data (ultra-high FPS mode)
                 array_bytes = payload_data
             else:
-                # Compressed data
-                array_bytes = zlib.decompress(payload_data)
-            
-            # Reconstruct numpy array with optimized operations
-            img_array = np.frombuffer(array_bytes, dtype=np.uint8).reshape((height, width, channels))
+                # Compressed data, continuing the stream unless the controllee restarted it
+                if codec == NUMPY_CODEC_ZLIB_RESET:
+                    self.zlibStream = zlib.decompressobj(-15)
+                elif self.zlibStream is None:
+                    return
+                array_bytes = self.zlibStream.decompress(payload_data)
             
-            # Convert numpy array to PIL Image (fastest method)
-            img = Image.fromarray(img_array, 'RGB')
+            # Build the PIL Image straight from the bytes, no numpy round-trip
+            img = Image.frombytes('RGB', (width, height), array_bytes)
             
             # Resize to fit label with fastest method
             newSize = self.getLabelSize()
             if newSize[0] > 0 and newSize[1] > 0:
-                img = img.resize(newSize, Image.NEAREST)  # NEAREST is fastest
+                if img.size != newSize:
+                    img = img.resize(newSize, Image.BILINEAR)
                 
                 # Anti-flicker: update in next idle cycle
                 new_image = ImageTk.PhotoImage(img)
@@ -223,17 +223,41 @@ class ControllerProtocol(ProtocolBase):
     def processJPEGData(self, data: bytes):
         """Process JPEG image data with anti-flicker optimization"""
         try:
-            newSize = self.getLabelSize()
-            if newSize[0] > 0 and newSize[1] > 0:
-                img = Image.open(BytesIO(data))
-                img = img.resize(newSize, Image.NEAREST)
-                
-                # Anti-flicker: update in next idle cycle
-                new_image = ImageTk.PhotoImage(img)
-                self.root.after_idle(lambda: self.updateImageSafe(new_image))
+            img = Image.open(BytesIO(data))
+            img.load()
+            self.baseImage = img  # Later deltas are pasted onto this frame
+            self.showImage(img)
         except Exception as e:
             print(f"Error processing JPEG data: {e}")
     
+    def processDeltaData(self, data: bytes):
+        """Paste a changed region ('DELTA' WebP or 'DELTR' raw RGB) onto the last full frame"""
+        try:
+            if self.baseImage is None:
+                return
+            x1, y1, x2, y2 = BBOX_HEADER.unpack_from(data, 5)
+            region_data = data[5 + BBOX_HEADER.size:]
+            if data.startswith(b'DELTR'):
+                region = Image.frombytes('RGB', (x2 - x1, y2 - y1), region_data)
+            else:
+                region = Image.open(BytesIO(region_data))
+            self.baseImage.paste(region, (x1, y1))
+            self.showImage(self.baseImage)
+        except Exception as e:
+            print(f"Error processing delta data: {e}")
+    
+    def showImage(self, img):
+        """Scale a frame to the label and display it"""
+        newSize = self.getLabelSize()
+        if newSize[0] > 0 and newSize[1] > 0:
+            # Skip the resize copy when the frame already fits the label
+            if img.size != newSize:
+                img = img.resize(newSize, Image.BILINEAR)
+            
+            # Anti-flicker: update in next idle cycle
+            new_image = ImageTk.PhotoImage(img)
+            self.root.after_idle(lambda: self.updateImageSafe(new_image))
+    
     def updateImageSafe(self, new_image):
         """Safely update image to prevent flicker"""
         try:
@@ -0,0 +1,64 @@
+"""
+Pixel kernels for the numpy screenshot path, compiled with Numba when available
+"""
+import numpy as np
+
+# Try to import Numba for compiled kernels
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+_specialized_kernels = {}
+
+def get_downsample_kernel(step):
+    """Return a kernel(src, dst) copying every step-th BGRA pixel of src into the contiguous RGB dst"""
+    kernel = _specialized_kernels.get(step)
+    if kernel is None:
+        if NUMBA_AVAILABLE:
+            # step is a closure constant, so LLVM folds the strides and can vectorize the copy;
+            # Numba's cache index hashes closure values, so each step gets its own cache entry
+            @njit(parallel=True, cache=True)
+            def kernel(src, dst):
+                for i in prange(dst.shape[0]):
+                    for j in range(dst.shape[1]):
+                        dst[i, j, 0] = src[i * step, j * step, 2]
+                        dst[i, j, 1] = src[i * step, j * step, 1]
+                        dst[i, j, 2] = src[i * step, j * step, 0]
+        else:
+            def kernel(src, dst):
+                np.copyto(dst, src[::step, ::step, 2::-1])
+        _specialized_kernels[step] = kernel
+    return kernel
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _changed_columns(a, b, first, last):
+        """Per row, the first and last column where a and b differ (-1 if none)"""
+        for i in prange(a.shape[0]):
+            first[i] = -1
+            last[i] = -1
+            for j in range(a.shape[1]):
+                if a[i, j, 0] != b[i, j, 0] or a[i, j, 1] != b[i, j, 1] or a[i, j, 2] != b[i, j, 2]:
+                    if first[i] < 0:
+                        first[i] = j
+                    last[i] = j
+
+def changed_bbox(a, b):
+    """Bounding box (left, top, right, bottom) of the pixels that differ, None if identical"""
+    if NUMBA_AVAILABLE:
+        first = np.empty(a.shape[0], dtype=np.int64)
+        last = np.empty(a.shape[0], dtype=np.int64)
+        _changed_columns(a, b, first, last)
+        rows = np.flatnonzero(last >= 0)
+        if rows.size == 0:
+            return None
+        return (int(first[rows].min()), int(rows[0]), int(last[rows].max()) + 1, int(rows[-1]) + 1)
+    
+    diff = (a != b).any(axis=2)
+    rows = np.flatnonzero(diff.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(diff.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
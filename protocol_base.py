@@ -3,6 +3,7 @@ from twisted.internet.protocol import Protocol
 import struct
 
 NUM_FORMAT = '<Q'
+LENGTH_PREFIX = struct.Struct(NUM_FORMAT)
 
 class ProtocolBase(Protocol):
     def __init__(self):
@@ -14,7 +15,7 @@ class ProtocolBase(Protocol):
         reactor.callLater(0.0001, self.flush)
 
     def writeMessage(self, newBytes):
-        self.buffer += struct.pack(NUM_FORMAT, len(newBytes))
+        self.buffer += LENGTH_PREFIX.pack(len(newBytes))
         self.buffer += newBytes
         
         # Immediate flush for any message to minimize latency
@@ -51,10 +52,10 @@ class ProtocolBase(Protocol):
 
     def processMessage(self):
         if self.receiveMessageLength == -1:
-            size = struct.calcsize(NUM_FORMAT)
+            size = LENGTH_PREFIX.size
             if len(self.receiveBuffer) < size:
                 return
-            self.receiveMessageLength = struct.unpack(NUM_FORMAT, self.receiveBuffer[:size])[0]
+            self.receiveMessageLength = LENGTH_PREFIX.unpack_from(self.receiveBuffer)[0]
             self.receiveBuffer = self.receiveBuffer[size:]
             self.processMessage()
         else:
@@ -3,7 +3,6 @@ PyQt5-based controller implementation for better performance and modern UI
 """
 import sys
 import time
-import struct
 import zlib
 import io
 import json
@@ -13,10 +12,23 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject, QThread
 from PyQt5.QtGui import QPixmap, QImage, QPainter
 from PIL import Image, ImageTk
-import numpy as np
 from constants import *
 from raw_transport import RawSocketProtocol
 
+# Try to import LZ4 for fast numpy frame compression
+try:
+    import lz4.block
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+# Try to import PyAV for H.264 streaming
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    AV_AVAILABLE = False
+
 class PyQt5ControllerProtocol(QObject):
     """Ultra-modern PyQt5-based controller with superior performance"""
     
@@ -47,6 +59,8 @@ class PyQt5ControllerProtocol(QObject):
         # Performance optimization variables
         self.last_image_size = None
         self.cached_pixmap = None
+        self._zd = None  # Matches the controllee's deflate stream
+        self._h264 = None  # H.264 decoder, created on the first VIDEO frame
         
         # Connect signals
         self.image_received.connect(self.update_display)
@@ -137,7 +151,8 @@ class PyQt5ControllerProtocol(QObject):
         
         # Store original pixmap for resize events
         self.original_pixmap = None
-        self.base_image = None  # For delta encoding
+        self.base_pixmap = None  # Canvas that delta regions are painted onto
+        self.numpy_pixmap = None  # Canvas that NUMPD regions are painted onto
         
         # Override resize event
         self.window.resizeEvent = self.window_resize_event
@@ -186,6 +201,13 @@ class PyQt5ControllerProtocol(QObject):
         self.update_checkbox.stateChanged.connect(self.change_update_commands)
         control_layout.addWidget(self.update_checkbox)
         
+        # H.264 checkbox (only when PyAV is installed)
+        self.h264_checkbox = QCheckBox("H.264")
+        self.h264_checkbox.setChecked(VAR_USE_H264_DEFAULT)
+        self.h264_checkbox.setEnabled(AV_AVAILABLE)
+        self.h264_checkbox.stateChanged.connect(self.change_h264)
+        control_layout.addWidget(self.h264_checkbox)
+        
         # FPS display
         control_layout.addWidget(QLabel("Current FPS:"))
         self.fps_display = QLabel("0.0")
@@ -210,9 +232,12 @@ class PyQt5ControllerProtocol(QObject):
     def change_update_commands(self, state):
         self.set_value(VAR_SHOULD_UPDATE_COMMANDS, state == Qt.Checked)
     
+    def change_h264(self, state):
+        self.set_value(VAR_USE_H264, state == Qt.Checked)
+    
     def set_value(self, variable, value):
         """Send configuration change to controllee"""
-        to_send = COMMAND_SET_VAR.encode('ascii')
+        to_send = COMMAND_SET_VAR_BYTES
         to_send += json.dumps({
             'variable': variable,
             'value': value
@@ -221,7 +246,7 @@ class PyQt5ControllerProtocol(QObject):
     
     def send_command(self, command_name, *args):
         """Send command to controllee"""
-        to_send = COMMAND_NEW_COMMAND.encode('ascii')
+        to_send = COMMAND_NEW_COMMAND_BYTES
         to_send += json.dumps([command_name, *args]).encode('ascii')
         self.write_message(to_send)
     
@@ -327,11 +352,14 @@ class PyQt5ControllerProtocol(QObject):
         print("PyQt5 Controller connected!")
         self.window.show()
         
+        # Let the controllee know which numpy codecs we can decode
+        self.set_value(VAR_USE_LZ4, LZ4_AVAILABLE)
+        
         # Request first screenshot immediately
         print("Requesting first screenshot...")
-        self.write_message(COMMAND_SEND_SCREENSHOT.encode('ascii'))
+        self.write_message(COMMAND_SEND_SCREENSHOT_BYTES)
     
-    def message_received(self, data: bytes):
+    def message_received(self, data: memoryview):
         """Handle received messages (called from transport thread)"""
         try:
             current_time = time.time()
@@ -346,10 +374,10 @@ class PyQt5ControllerProtocol(QObject):
 
             
             # Emit signal for image processing (thread-safe)
-            self.image_received.emit(data)
+            self.image_received.emit(bytes(data))  # Copied, the view dies with this call
             
             # Request next screenshot immediately for maximum FPS
-            self.write_message(COMMAND_SEND_SCREENSHOT.encode('ascii'))
+            self.write_message(COMMAND_SEND_SCREENSHOT_BYTES)
             
         except Exception as e:
             print(f"PyQt5 Controller message error: {e}")
@@ -360,6 +388,10 @@ class PyQt5ControllerProtocol(QObject):
             # Fast path processing - minimize checks
             if data.startswith(b'NUMPY'):
                 self.process_numpy_data(data[5:])
+            elif data.startswith(b'NUMPD'):
+                self.process_numpy_delta(data[5:])
+            elif data.startswith(b'VIDEO'):
+                self.process_h264_data(data[5:])
             else:
                 self.process_jpeg_data(data)
         except Exception as e:
@@ -368,82 +400,115 @@ class PyQt5ControllerProtocol(QObject):
     
     def process_numpy_data(self, data: bytes):
         """Process numpy array data"""
+        pixmap = self.decode_numpy_data(data)
+        if pixmap is not None:
+            self.numpy_pixmap = pixmap  # Patched in place by later NUMPD regions
+            self.set_pixmap_with_aspect_ratio(pixmap)
+    
+    def process_numpy_delta(self, data: bytes):
+        """Paint a changed numpy region onto the last full frame"""
+        bbox_size = BBOX_HEADER.size
+        x1, y1, x2, y2 = BBOX_HEADER.unpack_from(data)
+        # Always decode, the region may continue the deflate stream
+        region_pixmap = self.decode_numpy_data(data[bbox_size:])
+        if region_pixmap is None or self.numpy_pixmap is None:
+            return
+        
+        painter = QPainter(self.numpy_pixmap)
+        painter.drawPixmap(x1, y1, region_pixmap)
+        painter.end()
+        self.set_pixmap_with_aspect_ratio(self.numpy_pixmap)
+    
+    def decode_numpy_data(self, data: bytes):
+        """Decode a numpy header and payload into a QPixmap"""
         try:
             # Read header
-            header_size = struct.calcsize('<III')
+            header_size = NUMPY_HEADER.size
             if len(data) < header_size:
-                return
+                return None
             
-            height, width, channels = struct.unpack('<III', data[:header_size])
+            height, width, channels, codec = NUMPY_HEADER.unpack_from(data)
             payload_data = data[header_size:]
             
-            expected_size = height * width * channels
-            
             # Decompress if needed
-            if len(payload_data) == expected_size:
+            if codec == NUMPY_CODEC_RAW:
                 array_bytes = payload_data
+            elif codec == NUMPY_CODEC_LZ4:
+                array_bytes = lz4.block.decompress(payload_data, uncompressed_size=height * width * channels)
             else:
-                array_bytes = zlib.decompress(payload_data)
-            
-            # Convert to numpy array
-            img_array = np.frombuffer(array_bytes, dtype=np.uint8).reshape((height, width, channels))
+                if codec == NUMPY_CODEC_ZLIB_RESET:
+                    self._zd = zlib.decompressobj(-15)
+                elif self._zd is None:
+                    return None
+                array_bytes = self._zd.decompress(payload_data)
             
-            # Handle different channel formats
-            if channels == 4:  # BGRA
-                # Convert BGRA to RGB
-                rgb_array = img_array[:, :, [2, 1, 0]]  # BGR -> RGB
-                qimage = QImage(rgb_array.data, width, height, width * 3, QImage.Format_RGB888)
-            elif channels == 3:  # BGR or RGB
-                # Assume BGR and convert to RGB
-                rgb_array = img_array[:, :, [2, 1, 0]]  # BGR -> RGB
-                qimage = QImage(rgb_array.data, width, height, width * 3, QImage.Format_RGB888)
-            else:
-                return
+            # Controllee already sends RGB, wrap the bytes directly
+            if channels != 3:
+                return None
+            qimage = QImage(array_bytes, width, height, width * 3, QImage.Format_RGB888)
             
-            # Convert to QPixmap and display with aspect ratio
-            pixmap = QPixmap.fromImage(qimage)
-            self.set_pixmap_with_aspect_ratio(pixmap)
+            # Convert to QPixmap
+            return QPixmap.fromImage(qimage)
             
         except Exception as e:
             print(f"Numpy processing error: {e}")
             import traceback
             traceback.print_exc()
+            return None
+    
+    def process_h264_data(self, data: bytes):
+        """Decode H.264 packets and display the resulting frames"""
+        try:
+            if self._h264 is None:
+                self._h264 = av.CodecContext.create('h264', 'r')
+            
+            for frame in self._h264.decode(av.Packet(data)):
+                img = frame.to_image()
+                rgb_bytes = img.tobytes()
+                qimage = QImage(rgb_bytes, img.width, img.height, img.width * 3, QImage.Format_RGB888)
+                self.set_pixmap_with_aspect_ratio(QPixmap.fromImage(qimage))
+                
+        except Exception as e:
+            print(f"H.264 processing error: {e}")
     
     def process_jpeg_data(self, data: bytes):
         """Process image data (WebP/JPEG) or delta updates - ultra-optimized for minimum latency"""
-        if data.startswith(b'DELTA'):
+        if data.startswith(b'DELTA') or data.startswith(b'DELTR'):
             # Delta update: apply patch to base image
-            import struct
-            header_size = 4 * 4  # 4 ints for bbox
+            header_size = BBOX_HEADER.size
             bbox_data = data[5:5+header_size]
-            x1, y1, x2, y2 = struct.unpack('<IIII', bbox_data)
+            x1, y1, x2, y2 = BBOX_HEADER.unpack(bbox_data)
             region_data = data[5+header_size:]
             
-            # Load region pixmap
-            region_pixmap = QPixmap()
-            if region_pixmap.loadFromData(region_data):
+            # Load region pixmap (DELTR carries raw RGB pixels for tiny regions)
+            if data.startswith(b'DELTR'):
+                width = x2 - x1
+                region_image = QImage(region_data, width, y2 - y1, width * 3, QImage.Format_RGB888)
+                region_pixmap = QPixmap.fromImage(region_image)
+            else:
+                region_pixmap = QPixmap()
+                region_pixmap.loadFromData(region_data)
+            if not region_pixmap.isNull():
                 # Create painter to apply patch
-                if self.base_image is None:
+                if self.base_pixmap is None:
                     # Fallback: treat as full image
-                    self.original_pixmap = region_pixmap
-                    self.image_label.setPixmap(region_pixmap)
+                    self.set_pixmap_with_aspect_ratio(region_pixmap)
                     return
                 
-                # Apply patch to base image
-                painter = QPainter(self.base_image)
+                # Paint only the changed region onto the persistent canvas, the label shows
+                # its own copy so the canvas isn't shared and QPainter doesn't detach it
+                painter = QPainter(self.base_pixmap)
                 painter.drawPixmap(x1, y1, region_pixmap)
                 painter.end()
                 
                 # Update display
-                self.original_pixmap = QPixmap.fromImage(self.base_image)
-                self.image_label.setPixmap(self.original_pixmap)
+                self.set_pixmap_with_aspect_ratio(self.base_pixmap)
         else:
             # Full image
             pixmap = QPixmap()
             if pixmap.loadFromData(data):
-                self.original_pixmap = pixmap
-                self.base_image = pixmap.toImage()  # Store as QImage for patching
-                self.image_label.setPixmap(pixmap)
+                self.base_pixmap = pixmap  # Patched in place by later deltas
+                self.set_pixmap_with_aspect_ratio(pixmap)
     
     def update_fps_label(self, fps_text):
         """Update FPS label (thread-safe)"""
@@ -454,7 +519,7 @@ class PyQt5ControllerProtocol(QObject):
         if pixmap.isNull():
             return
         
-        # Store original pixmap
+        # Store original pixmap for resizes, a Python reference only so Qt doesn't share its pixels
         self.original_pixmap = pixmap
         
         # Get the label size
@@ -462,15 +527,19 @@ class PyQt5ControllerProtocol(QObject):
         
         # Check if scaling is needed
         if pixmap.size() == label_size:
-            self.image_label.setPixmap(pixmap)
-            return
-        
-        # Use fast transformation for better FPS
-        scaled_pixmap = pixmap.scaled(
-            label_size, 
-            Qt.KeepAspectRatio, 
-            Qt.FastTransformation  # Faster rendering
-        )
+            scaled_pixmap = pixmap
+        else:
+            # Use fast transformation for better FPS
+            scaled_pixmap = pixmap.scaled(
+                label_size, 
+                Qt.KeepAspectRatio, 
+                Qt.FastTransformation  # Faster rendering
+            )
+        
+        # An unscaled canvas would share its pixels with the label and the next QPainter
+        # on it would copy the whole frame, so the label gets its own copy instead
+        if scaled_pixmap.cacheKey() == pixmap.cacheKey() and (pixmap is self.base_pixmap or pixmap is self.numpy_pixmap):
+            scaled_pixmap = pixmap.copy()
         
         self.image_label.setPixmap(scaled_pixmap)
     
@@ -499,15 +568,10 @@ class PyQt5ControllerProtocol(QObject):
         if self.protocol:
             self.protocol.write_message(data)
     
-    def _send_worker(self):
-        """Delegate to protocol"""
-        if self.protocol:
-            return self.protocol._send_worker()
-    
-    def _receive_worker(self):
+    def _io_worker(self):
         """Delegate to protocol"""
         if self.protocol:
-            return self.protocol._receive_worker()
+            return self.protocol._io_worker()
     
     @property
     def socket(self):
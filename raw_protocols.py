@@ -7,13 +7,86 @@ import threading
 from mss import mss
 import numpy as np
 import zlib
-import struct
 import io
+import json
+import queue
 import PIL.Image
 from constants import *
 import commands
 from raw_transport import RawSocketProtocol
+from fast_kernels import get_downsample_kernel, changed_bbox
+from capture_backend import DXGICapturer
 import tkinter
+from fractions import Fraction
+
+# Try to import PyAV for H.264 streaming
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    AV_AVAILABLE = False
+
+# Try to import OpenCV for SIMD color conversion
+try:
+    import cv2
+    cv2.setNumThreads(1)  # Capture, encode and send already have their own threads
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# Try to import LZ4 for fast numpy frame compression
+try:
+    import lz4.block
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+# Try to import PyTurboJPEG for SIMD JPEG encoding
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGRX, TJPF_RGB, TJSAMP_420, TJSAMP_444, TJFLAG_FASTDCT
+    TURBOJPEG_AVAILABLE = True
+except ImportError:
+    TURBOJPEG_AVAILABLE = False
+
+# Try to import pynvjpeg for GPU JPEG encoding
+try:
+    from nvjpeg import NvJpeg
+    NVJPEG_AVAILABLE = True
+except ImportError:
+    NVJPEG_AVAILABLE = False
+
+# Try to import orjson for faster command serialization
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+if ORJSON_AVAILABLE:
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj):
+        return json.dumps(obj).encode('ascii')
+    def json_loads(data):
+        return json.loads(bytes(data))  # Accepts the transport's memoryviews like orjson does
+
+SEND_BACKLOG_LIMIT = 262144  # Unsent bytes past which the controllee skips frames instead of queueing them
+DECODE_BACKLOG_LIMIT = 2  # Queued frames past which the controller skips JPEG frames
+DECODE_QUEUE_SIZE = 8  # Queued frames past which the controller drops the backlog and restarts the stream
+_STREAM_RESTART = object()  # Decode queue marker: forget the decoder state of the dropped frames
+
+def _put_dropping_oldest(q, item):
+    """Put item on a bounded queue, discarding the oldest entries until it fits"""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
 
 def create_raw_controller_protocol():
     """Factory function to create RawControllerProtocol with tkinter root"""
@@ -27,11 +100,41 @@ class RawControlleeProtocol(RawSocketProtocol):
     def __init__(self):
         super().__init__()
         self.config = {}
-        self.last_screenshot_time = 0
-        self.screenshot_interval = 1.0 / VAR_FPS_DEFAULT
-        self.screenshot_lock = threading.Lock()
-        self.is_processing_screenshot = False
+        self.last_screenshot_ns = 0
+        self.screenshot_interval_ns = 1_000_000_000 // VAR_FPS_DEFAULT
         self.screenshot_thread = None
+        self.encode_thread = None
+        self.frame_queue = queue.Queue(maxsize=2)  # Captured frames waiting for the encoder
+        self._tick = threading.Event()  # Wakes the screenshot loop early (FPS change, stop)
+        self._monitor = None  # Cached monitor rect, reset when VAR_MONITOR changes
+        self._dxgi = None  # DXGI capturer for the cached monitor, None when using mss
+        self._rgb_buf = None  # Reused BGR -> RGB output buffer
+        self._pipeline_cache = {}  # (height, width, step) -> (specialized kernel, output buffer)
+        self._encoder = None  # Selected send_screenshot_* method, reset on config changes
+        self._encoder_gen = 0  # Bumped with each reset, so a selection made from the old config isn't kept
+        self._prev_rgb = None  # Last sent numpy frame, for dirty-rect detection
+        self._zc = None  # Deflate stream reused across numpy frames
+        self._zc_level = None
+        self._h264 = None  # H.264 encoder, recreated when the frame size changes
+        self._h264_pts = 0
+        self._restart_stream = False  # Set by the controller, handled on the encode thread
+        self.frames_skipped = 0  # Frames not encoded because the link was behind
+        
+        # libjpeg-turbo encoder, falls back to PIL if the library can't be loaded
+        self._tj = None
+        if TURBOJPEG_AVAILABLE:
+            try:
+                self._tj = TurboJPEG()
+            except Exception as e:
+                print(f"TurboJPEG unavailable, using PIL: {e}")
+        
+        # NVJPEG encoder for the numpy path, needs a CUDA GPU
+        self._nvjpeg = None
+        if NVJPEG_AVAILABLE:
+            try:
+                self._nvjpeg = NvJpeg()
+            except Exception as e:
+                print(f"NVJPEG unavailable, using CPU compression: {e}")
         
         # Initialize config
         self.set_variable(VAR_SCALE, VAR_SCALE_DEFAULT, False)
@@ -41,6 +144,14 @@ class RawControlleeProtocol(RawSocketProtocol):
         self.set_variable(VAR_JPEG_QUALITY, VAR_JPEG_QUALITY_DEFAULT, False)
         self.set_variable(VAR_USE_NUMPY, VAR_USE_NUMPY_DEFAULT, False)
         self.set_variable(VAR_COMPRESSION_LEVEL, VAR_COMPRESSION_LEVEL_DEFAULT, False)
+        self.set_variable(VAR_USE_H264, VAR_USE_H264_DEFAULT, False)
+        
+        # Dispatch table keyed by the command tag, avoids decoding every message
+        self._handlers = {
+            COMMAND_SEND_SCREENSHOT_BYTES[:COMMAND_TAG_LENGTH]: self._handle_send_screenshot,
+            COMMAND_SET_VAR_BYTES[:COMMAND_TAG_LENGTH]: self._handle_set_var,
+            COMMAND_NEW_COMMAND_BYTES[:COMMAND_TAG_LENGTH]: self._handle_command,
+        }
         
         # Set message handler
         self.set_message_handler(self.message_received)
@@ -54,131 +165,333 @@ class RawControlleeProtocol(RawSocketProtocol):
         print("Raw controllee connected")
         self.print_config()
         
-        # Start ultra-aggressive screenshot loop
+        # Capture and encode run on separate threads so the slower stage alone bounds FPS,
+        # sending already has its own thread in RawSocketProtocol
         self.screenshot_thread = threading.Thread(target=self._screenshot_loop, daemon=True)
         self.screenshot_thread.start()
+        self.encode_thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self.encode_thread.start()
     
     def _screenshot_loop(self):
-        """Ultra-high performance screenshot loop"""
-        while self.running:
-            try:
-                current_time = time.time()
+        """Capture stage: grabs frames at the configured FPS and hands them to the encoder"""
+        # One capture context for the life of the thread (mss handles are per-thread)
+        with mss() as sct:
+            while self.running:
+                try:
+                    now_ns = time.monotonic_ns()
                 
-                # Ultra-aggressive timing
-                if current_time - self.last_screenshot_time >= self.screenshot_interval:
-                    with self.screenshot_lock:
-                        if not self.is_processing_screenshot:
-                            self.is_processing_screenshot = True
-                            self.last_screenshot_time = current_time
-                            
-                            try:
-                                # Smart method selection
-                                fps_target = self.config.get(VAR_FPS, VAR_FPS_DEFAULT)
-                                use_numpy = self.config.get(VAR_USE_NUMPY, VAR_USE_NUMPY_DEFAULT)
-                                scale = self.config.get(VAR_SCALE, VAR_SCALE_DEFAULT)
-                                
-                                if use_numpy and scale <= 0.5 and fps_target >= 90:
-                                    self.send_screenshot_numpy()
-                                else:
-                                    self.send_screenshot_jpeg()
-                            finally:
-                                self.is_processing_screenshot = False
+                    # Sleep until the next frame is due; the deadline is recomputed after
+                    # every wake so an FPS change takes effect immediately
+                    wait_ns = self.last_screenshot_ns + self.screenshot_interval_ns - now_ns
+                    if wait_ns > 0:
+                        self._tick.wait(wait_ns / 1e9)
+                        self._tick.clear()
+                        continue
                 
-                # Minimal sleep for ultra-low latency
-                time.sleep(0.001)  # 1ms for maximum responsiveness
+                    # Only this thread captures, so no lock or in-progress flag is needed
+                    self.last_screenshot_ns = now_ns
+                    ss = self._grab(sct)
+                    if ss is not None:
+                        self._queue_frame(ss)
                 
-            except Exception as e:
-                print(f"Screenshot loop error: {e}")
-                time.sleep(0.001)
+                except Exception as e:
+                    print(f"Screenshot loop error: {e}")
+                    time.sleep(0.001)
     
-    def send_screenshot_numpy(self):
-        """Ultra-fast numpy implementation"""
-        with mss() as sct:
-            monitor_idx = min(self.config[VAR_MONITOR], len(sct.monitors) - 1)
-            ss = sct.grab(sct.monitors[monitor_idx])
-            
-            # Direct numpy conversion
-            img_array = np.frombuffer(ss.bgra, dtype=np.uint8).reshape((ss.height, ss.width, 4))
-            rgb_array = img_array[:, :, [2, 1, 0]]  # BGR to RGB
-            
-            # Ultra-fast downsampling
-            if self.config[VAR_SCALE] < 1:
-                step = max(1, int(1/self.config[VAR_SCALE]))
-                rgb_array = rgb_array[::step, ::step]
+    def _queue_frame(self, ss):
+        """Queue a captured frame, dropping the oldest one if the encoder is behind"""
+        # Capture thread and stop() both put here, retry until the item fits
+        _put_dropping_oldest(self.frame_queue, ss)
+    
+    def _encode_loop(self):
+        """Encode stage: compresses captured frames and queues them for sending"""
+        while self.running:
+            # Block until a frame arrives, stop() wakes us with None
+            ss = self.frame_queue.get()
+            if ss is None:
+                break
             
-            # Adaptive compression
-            fps_target = self.config.get(VAR_FPS, VAR_FPS_DEFAULT)
-            header = struct.pack('<III', rgb_array.shape[0], rgb_array.shape[1], rgb_array.shape[2])
+            if self.unsent_bytes > SEND_BACKLOG_LIMIT:
+                # The link is behind: skip this frame rather than grow the send backlog.
+                # Nothing was encoded, so delta and compression state stay consistent
+                self.frames_skipped += 1
+                continue
             
-            if fps_target > 120:
-                # Raw mode for extreme FPS
-                message_data = b'NUMPY' + header + rgb_array.tobytes()
+            try:
+                if self._restart_stream:
+                    # Drop all inter-frame state so the next frame decodes on its own
+                    self._restart_stream = False
+                    self._prev_rgb = None
+                    self._zc = None
+                    self._h264 = None
+                
+                # set_variable clears _encoder from the I/O thread, so read it once
+                encoder = self._encoder
+                if encoder is None:
+                    gen = self._encoder_gen
+                    encoder = self._select_encoder()
+                    if gen == self._encoder_gen:
+                        self._encoder = encoder
+                encoder(ss)
+            except Exception as e:
+                print(f"Encode loop error: {e}")
+    
+    def _select_encoder(self):
+        """Smart method selection, only rerun when the config changes"""
+        fps_target = self.config.get(VAR_FPS, VAR_FPS_DEFAULT)
+        use_numpy = self.config.get(VAR_USE_NUMPY, VAR_USE_NUMPY_DEFAULT)
+        scale = self.config.get(VAR_SCALE, VAR_SCALE_DEFAULT)
+        
+        if AV_AVAILABLE and self.config.get(VAR_USE_H264, VAR_USE_H264_DEFAULT):
+            return self.send_screenshot_h264
+        elif use_numpy and scale <= 0.5 and fps_target >= 90:
+            return self.send_screenshot_numpy
+        else:
+            return self.send_screenshot_jpeg
+    
+    @staticmethod
+    def _bgra_view(ss):
+        """Zero-copy (height, width, 4) view of a capture, ss.bgra would copy the whole frame"""
+        return np.asarray(memoryview(ss.raw).cast('B', shape=(ss.height, ss.width, 4)))
+    
+    def _grab(self, sct):
+        """Grab the selected monitor, resolving it only after a monitor change"""
+        if self._monitor is None:
+            monitor_idx = min(self.config[VAR_MONITOR], len(sct.monitors) - 1)
+            self._monitor = sct.monitors[monitor_idx]
+            self._dxgi = DXGICapturer.for_monitor(monitor_idx)
+        if self._dxgi is not None:
+            # Event-driven: None (no copy, no encode) while the screen is idle
+            return self._dxgi.grab()
+        return sct.grab(self._monitor)
+    
+    def send_screenshot_numpy(self, ss):
+        """Ultra-fast numpy implementation"""
+        # Direct numpy conversion
+        img_array = self._bgra_view(ss)
+        
+        if self.config[VAR_SCALE] < 1:
+            # Downsample and convert in one pass, only touching the kept pixels
+            step = max(1, int(1/self.config[VAR_SCALE]))
+            key = (ss.height, ss.width, step)
+            pipeline = self._pipeline_cache.get(key)
+            if pipeline is None:
+                # Kernel compiled with the step baked in, first frame after a scale/monitor change
+                shape = ((ss.height + step - 1) // step, (ss.width + step - 1) // step, 3)
+                pipeline = (get_downsample_kernel(step), np.empty(shape, dtype=np.uint8))
+                self._pipeline_cache[key] = pipeline
+            kernel, rgb_array = pipeline
+            kernel(img_array, rgb_array)
+        else:
+            if self._rgb_buf is None or self._rgb_buf.shape[:2] != img_array.shape[:2]:
+                self._rgb_buf = np.empty((ss.height, ss.width, 3), dtype=np.uint8)
+            if CV2_AVAILABLE:
+                # SIMD conversion that drops alpha in the same pass
+                rgb_array = cv2.cvtColor(img_array, cv2.COLOR_BGRA2RGB, dst=self._rgb_buf)
             else:
-                # Compressed mode
-                compression_level = self.config.get(VAR_COMPRESSION_LEVEL, VAR_COMPRESSION_LEVEL_DEFAULT)
-                compressed_data = zlib.compress(rgb_array.tobytes(), compression_level)
-                message_data = b'NUMPY' + header + compressed_data
-            
-            self.write_message(message_data)
+                rgb_array = np.take(img_array, [2, 1, 0], axis=2, out=self._rgb_buf)  # BGR to RGB
+        
+        # Dirty-rect detection: skip unchanged frames, send only the changed region of small updates
+        bbox = None
+        if self._prev_rgb is not None and self._prev_rgb.shape == rgb_array.shape:
+            bbox = changed_bbox(rgb_array, self._prev_rgb)
+            if bbox is None:
+                return  # Nothing changed since the last frame
+            left, top, right, bottom = bbox
+            if (right - left) * (bottom - top) * 2 > rgb_array.shape[0] * rgb_array.shape[1]:
+                bbox = None  # Most of the screen changed, send the whole frame
+            np.copyto(self._prev_rgb, rgb_array)
+        else:
+            self._prev_rgb = rgb_array.copy()
+        
+        if self._nvjpeg is not None:
+            # GPU JPEG, the controller displays it like any other JPEG frame
+            bgr_array = np.ascontiguousarray(rgb_array[:, :, ::-1])  # nvjpeg takes OpenCV order
+            self.write_message(self._nvjpeg.encode(bgr_array, self._jpeg_kwargs['quality']))
+            return
+        
+        if bbox is not None:
+            # NUMPD: changed region's bbox, then a regular numpy header and payload for the region
+            rgb_array = np.ascontiguousarray(rgb_array[top:bottom, left:right])
+            tag = b'NUMPD' + BBOX_HEADER.pack(*bbox)
+        else:
+            tag = b'NUMPY'
+        
+        # Adaptive compression
+        fps_target = self.config.get(VAR_FPS, VAR_FPS_DEFAULT)
+        
+        if fps_target > 120:
+            # Raw mode for extreme FPS
+            header = NUMPY_HEADER.pack(*rgb_array.shape, NUMPY_CODEC_RAW)
+            # rgb_array may be the reused capture buffer, so it's copied once into the framed message
+            self.write_message_parts(tag, header, rgb_array)
+            return
+        elif LZ4_AVAILABLE and self.config.get(VAR_USE_LZ4, VAR_USE_LZ4_DEFAULT):
+            # LZ4 is several times cheaper than deflate at a similar ratio on screen content
+            header = NUMPY_HEADER.pack(*rgb_array.shape, NUMPY_CODEC_LZ4)
+            compressed_data = lz4.block.compress(rgb_array, mode='fast', acceleration=4, store_size=False)
+            message_parts = (tag, header, compressed_data)
+        else:
+            # Compressed mode - one deflate stream for the whole session
+            compression_level = self.config.get(VAR_COMPRESSION_LEVEL, VAR_COMPRESSION_LEVEL_DEFAULT)
+            if self._zc is None or self._zc_level != compression_level:
+                # Z_RLE suits screen pixels (long runs) and is much faster than the default strategy
+                self._zc = zlib.compressobj(compression_level, zlib.DEFLATED, -15, 8, zlib.Z_RLE)
+                self._zc_level = compression_level
+                codec = NUMPY_CODEC_ZLIB_RESET
+            else:
+                codec = NUMPY_CODEC_ZLIB
+            header = NUMPY_HEADER.pack(*rgb_array.shape, codec)
+            # Compress straight from the reused buffer, no tobytes() copy
+            message_parts = (tag, header, self._zc.compress(rgb_array), self._zc.flush(zlib.Z_SYNC_FLUSH))
+        
+        # Compressed parts are fresh objects nobody else touches, send them as-is
+        self.write_message_iov(*message_parts)
     
-    def send_screenshot_jpeg(self):
+    def send_screenshot_h264(self, ss):
+        """H.264 inter-frame encoding, far fewer bytes than full frames"""
+        img = PIL.Image.frombytes('RGB', ss.size, ss.raw, 'raw', 'BGRX')
+        
+        scale = self.config[VAR_SCALE]
+        if scale < 1.0:
+            new_size = (int(img.size[0] * scale), int(img.size[1] * scale))
+            img = img.resize(new_size, PIL.Image.NEAREST)
+        
+        # yuv420p needs even dimensions
+        width, height = img.size[0] & ~1, img.size[1] & ~1
+        if (width, height) != img.size:
+            img = img.crop((0, 0, width, height))
+        
+        if self._h264 is None or (self._h264.width, self._h264.height) != (width, height):
+            self._h264 = av.CodecContext.create('libx264', 'w')
+            self._h264.width = width
+            self._h264.height = height
+            self._h264.pix_fmt = 'yuv420p'
+            self._h264.time_base = Fraction(1, 1000)
+            self._h264.options = {'preset': 'ultrafast', 'tune': 'zerolatency'}
+            self._h264_pts = 0
+        
+        frame = av.VideoFrame.from_image(img).reformat(format='yuv420p')
+        frame.pts = self._h264_pts
+        self._h264_pts += 1000 // max(1, self.config.get(VAR_FPS, VAR_FPS_DEFAULT))
+        
+        packets = self._h264.encode(frame)
+        if packets:
+            self.write_message(b'VIDEO' + b''.join(bytes(packet) for packet in packets))
+    
+    def send_screenshot_jpeg(self, ss):
         """Ultra-optimized JPEG implementation for minimum latency"""
-        with mss() as sct:
-            monitor_idx = min(self.config[VAR_MONITOR], len(sct.monitors) - 1)
-            ss = sct.grab(sct.monitors[monitor_idx])
-            
+        scale = self.config[VAR_SCALE]
+        
+        if self._tj is not None and scale >= 1.0:
+            # Encode the captured BGRX buffer as-is, no PIL conversion
+            bgrx = self._bgra_view(ss)
+            self.write_message(self._tj.encode(bgrx, pixel_format=TJPF_BGRX, **self._tj_kwargs))
+            return
+        
+        if CV2_AVAILABLE and scale < 1.0:
+            # SIMD box-filter downscale straight from the BGRX buffer
+            new_size = (int(ss.width * scale), int(ss.height * scale))
+            bgrx = self._bgra_view(ss)
+            bgrx = cv2.resize(bgrx, new_size, interpolation=cv2.INTER_AREA)
+            if self._tj is not None:
+                self.write_message(self._tj.encode(bgrx, pixel_format=TJPF_BGRX, **self._tj_kwargs))
+                return
+            img = PIL.Image.frombuffer('RGB', new_size, bgrx, 'raw', 'BGRX', 0, 1)
+        else:
             # Direct RGB conversion without intermediate steps
-            img = PIL.Image.frombytes('RGB', ss.size, ss.bgra, 'raw', 'BGRX')
+            img = PIL.Image.frombytes('RGB', ss.size, ss.raw, 'raw', 'BGRX')
             
             # Scale only if necessary
-            scale = self.config[VAR_SCALE]
             if scale < 1.0:
                 new_size = (int(img.size[0] * scale), int(img.size[1] * scale))
                 # Use NEAREST for fastest scaling
                 img = img.resize(new_size, PIL.Image.NEAREST)
+        
+        if self._tj is not None:
+            self.write_message(self._tj.encode(np.asarray(img), pixel_format=TJPF_RGB, **self._tj_kwargs))
+            return
+        
+        # PIL fallback: frame the message straight from the BytesIO buffer, no getvalue() copy
+        with io.BytesIO() as output:
+            img.save(output, **self._jpeg_kwargs)
             
-            # Ultra-aggressive JPEG settings for speed
-            fps_target = self.config.get(VAR_FPS, VAR_FPS_DEFAULT)
-            if fps_target >= 60:
-                quality = 15  # Very low quality for max speed
-                subsampling = 2  # Aggressive subsampling
-            else:
-                quality = self.config.get(VAR_JPEG_QUALITY, VAR_JPEG_QUALITY_DEFAULT)
-                subsampling = 0
-            
-            # Direct to bytes without intermediate BytesIO
-            with io.BytesIO() as output:
-                img.save(output, format="JPEG", 
-                        quality=quality, 
-                        optimize=False,  # Disable optimization for speed
-                        progressive=False,  # Disable progressive for speed
-                        subsampling=subsampling)
-                
-                self.write_message(output.getvalue())
-    
-    def message_received(self, data: bytes):
+            with output.getbuffer() as jpeg_data:
+                self.write_message_parts(jpeg_data)
+    
+    def _update_jpeg_kwargs(self):
+        """Rebuild JPEG encoder settings, only needed when FPS or quality changes"""
+        fps_target = self.config.get(VAR_FPS, VAR_FPS_DEFAULT)
+        if fps_target >= 60:
+            quality = 15  # Very low quality for max speed
+            subsampling = 2  # Aggressive subsampling
+        else:
+            quality = self.config.get(VAR_JPEG_QUALITY, VAR_JPEG_QUALITY_DEFAULT)
+            subsampling = 0
+        
+        self._jpeg_kwargs = {
+            'format': 'JPEG',
+            'quality': quality,
+            'optimize': False,  # Disable optimization for speed
+            'progressive': False,  # Disable progressive for speed
+            'subsampling': subsampling,
+        }
+        
+        if TURBOJPEG_AVAILABLE:
+            self._tj_kwargs = {
+                'quality': quality,
+                'jpeg_subsample': TJSAMP_420 if subsampling == 2 else TJSAMP_444,
+                'flags': TJFLAG_FASTDCT,
+            }
+    
+    def message_received(self, data: memoryview):
         """Handle received messages"""
         try:
-            decoded = data.decode('ascii')
-            
-            if decoded == COMMAND_SEND_SCREENSHOT:
-                pass  # Screenshots are sent automatically
-            elif decoded.startswith(COMMAND_SET_VAR):
-                command_info = __import__('json').loads(decoded[len(COMMAND_SET_VAR):])
-                self.set_variable(**command_info)
-            elif decoded.startswith(COMMAND_NEW_COMMAND):
-                command_info = __import__('json').loads(decoded[len(COMMAND_NEW_COMMAND):])
-                self.commands.addCommand(*command_info)
+            handler = self._handlers.get(bytes(data[:COMMAND_TAG_LENGTH]))
+            if handler:
+                handler(data)
         except Exception as e:
             print(f"Message processing error: {e}")
     
+    def _handle_send_screenshot(self, data: memoryview):
+        pass  # Screenshots are sent automatically
+    
+    def _handle_set_var(self, data: memoryview):
+        command_info = json_loads(data[len(COMMAND_SET_VAR):])
+        self.set_variable(**command_info)
+    
+    def _handle_command(self, data: memoryview):
+        command_info = json_loads(data[len(COMMAND_NEW_COMMAND):])
+        self.commands.addCommand(*command_info)
+    
     def set_variable(self, variable, value, should_print=True):
         """Set configuration variable"""
+        if variable == VAR_RESTART_STREAM:
+            self._restart_stream = True  # The encode thread owns the stream state
+            return
+        
         self.config[variable] = value
         
         # Update FPS interval
         if variable == VAR_FPS and value > 0:
-            self.screenshot_interval = 1.0 / value
+            self.screenshot_interval_ns = int(1_000_000_000 / value)
+            self._tick.set()
+        
+        if variable == VAR_MONITOR:
+            self._monitor = None
+        
+        if variable in (VAR_MONITOR, VAR_SCALE):
+            self._pipeline_cache.clear()
+        
+        if variable in (VAR_FPS, VAR_SCALE, VAR_USE_NUMPY, VAR_USE_H264):
+            self._encoder_gen += 1
+            self._encoder = None
+        
+        if variable in (VAR_MONITOR, VAR_FPS, VAR_SCALE, VAR_USE_NUMPY, VAR_USE_H264):
+            self._prev_rgb = None  # Next numpy frame is sent whole
+        
+        if variable in (VAR_FPS, VAR_JPEG_QUALITY):
+            self._update_jpeg_kwargs()
             
         if should_print:
             self.print_config()
@@ -190,6 +503,8 @@ class RawControlleeProtocol(RawSocketProtocol):
     def stop(self):
         """Stop the protocol"""
         super().stop()
+        self._tick.set()
+        self._queue_frame(None)  # Wake the encode thread
         if self.commands:
             self.commands.shouldRun = False
 
@@ -201,6 +516,12 @@ class RawControllerProtocol(RawSocketProtocol):
         super().__init__()
         self.tk_root = tk_root
         self.last_received_time = time.time()
+        self._zd = None  # Matches the controllee's deflate stream
+        self._h264 = None  # H.264 decoder, created on the first VIDEO frame
+        self._canvas = None  # Last numpy frame, NUMPD regions are pasted onto it
+        self._decode_q = queue.Queue(maxsize=DECODE_QUEUE_SIZE)  # Received frames waiting for the decode thread
+        self._awaiting_restart = False  # Backlog dropped, skipping frames until a self-contained one
+        self._label_size = (0, 0)  # Last known label size, updated on <Configure>
         
         # Set message handler
         self.set_message_handler(self.message_received)
@@ -258,6 +579,14 @@ class RawControllerProtocol(RawSocketProtocol):
                                           variable=self.update_var)
         update_check.pack(side=tkinter.LEFT)
         
+        # H.264 checkbox (only when PyAV is installed)
+        self.h264_var = tkinter.BooleanVar(self.root, VAR_USE_H264_DEFAULT)
+        h264_check = tkinter.Checkbutton(frame, text='H.264', 
+                                        command=self.change_h264, 
+                                        variable=self.h264_var,
+                                        state=tkinter.NORMAL if AV_AVAILABLE else tkinter.DISABLED)
+        h264_check.pack(side=tkinter.LEFT)
+        
         # FPS label
         tkinter.Label(frame, text='FPS:').pack(side=tkinter.LEFT)
         self.fps_label = tkinter.Label(frame, text='?')
@@ -268,7 +597,7 @@ class RawControllerProtocol(RawSocketProtocol):
         self.label.pack(fill=tkinter.BOTH, expand=True)
         
         # Initialize with a black image to prevent white flash
-        self.current_image = None
+        self.current_image = None  # Reused Tk photo that every frame is written into
         self.create_initial_black_image()
         
         # Bind events
@@ -277,16 +606,16 @@ class RawControllerProtocol(RawSocketProtocol):
         self.label.bind('<Button>', self.on_mouse_down)
         self.label.bind('<ButtonRelease>', self.on_mouse_up)
         self.label.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.label.bind('<Configure>', self._on_label_configure)
         
         self.root.focus_set()
     
     def create_initial_black_image(self):
         """Create initial black image to prevent white flash"""
         try:
-            from PIL import Image, ImageTk
             # Create a small black image
-            black_img = Image.new('RGB', (100, 100), color='black')
-            self.current_image = ImageTk.PhotoImage(black_img)
+            self.current_image = tkinter.PhotoImage(width=100, height=100)
+            self.current_image.put('black', to=(0, 0, 100, 100))
             self.label.configure(image=self.current_image)
         except Exception as e:
             print(f"Error creating initial black image: {e}")
@@ -294,8 +623,11 @@ class RawControllerProtocol(RawSocketProtocol):
     def connection_made(self):
         """Called when connection is established"""
         print("Raw controller connected")
+        threading.Thread(target=self._decode_worker, daemon=True).start()
+        # Let the controllee know which numpy codecs we can decode
+        self.set_value(VAR_USE_LZ4, LZ4_AVAILABLE)
         # Request first screenshot
-        self.write_message(COMMAND_SEND_SCREENSHOT.encode('ascii'))
+        self.write_message(COMMAND_SEND_SCREENSHOT_BYTES)
     
     # Control methods
     def change_monitor(self, new_monitor: str):
@@ -313,19 +645,20 @@ class RawControllerProtocol(RawSocketProtocol):
     def change_update_commands(self):
         self.set_value(VAR_SHOULD_UPDATE_COMMANDS, self.update_var.get())
     
+    def change_h264(self):
+        self.set_value(VAR_USE_H264, self.h264_var.get())
+    
     def set_value(self, variable, value):
-        import json
-        to_send = COMMAND_SET_VAR.encode('ascii')
-        to_send += json.dumps({
+        to_send = COMMAND_SET_VAR_BYTES
+        to_send += json_dumps({
             'variable': variable,
             'value': value
-        }).encode('ascii')
+        })
         self.write_message(to_send)
     
     def send_command(self, command_name, *args):
-        import json
-        to_send = COMMAND_NEW_COMMAND.encode('ascii')
-        to_send += json.dumps([command_name, *args]).encode('ascii')
+        to_send = COMMAND_NEW_COMMAND_BYTES
+        to_send += json_dumps([command_name, *args])
         self.write_message(to_send)
     
     def get_local_position(self, x, y):
@@ -361,102 +694,197 @@ class RawControllerProtocol(RawSocketProtocol):
     def on_key_up(self, event):
         self.send_key_event(event, False)
     
+    def stop(self):
+        """Stop the protocol"""
+        super().stop()
+        _put_dropping_oldest(self._decode_q, None)  # Wake the decode thread
+    
     def on_close_clicked(self):
         self.stop()
         if hasattr(self.tk_root, 'quit'):
             self.tk_root.quit()
     
-    def message_received(self, data: bytes):
+    def message_received(self, data: memoryview):
         """Handle received screenshots"""
         try:
             current_time = time.time()
+            data = bytes(data)  # Outlives the transport's buffer on the decode queue
             
-            # Process image data (numpy or JPEG)
-            if data.startswith(b'NUMPY'):
-                self.process_numpy_data(data[5:])
-            else:
-                self.process_jpeg_data(data)
+            # Hand the frame to the decode thread so the I/O thread is free for input and the next frame
+            self._queue_decode(data)
             
-            # Calculate and display FPS
+            # Calculate and display FPS, Tk widgets are only touched from the Tk thread
             if hasattr(self, 'last_received_time') and hasattr(self, 'fps_label'):
                 fps = 1.0 / (current_time - self.last_received_time)
-                self.fps_label['text'] = f'{fps:.1f}'
+                self.tk_root.after(0, self.fps_label.configure, {'text': f'{fps:.1f}'})
             
             self.last_received_time = current_time
             
-            # Request next screenshot immediately
-            self.write_message(COMMAND_SEND_SCREENSHOT.encode('ascii'))
+            # Request next screenshot immediately, overlapping its round trip with the decode
+            self.write_message(COMMAND_SEND_SCREENSHOT_BYTES)
             
         except Exception as e:
             print(f"Controller message error: {e}")
             # Still request next screenshot
-            self.write_message(COMMAND_SEND_SCREENSHOT.encode('ascii'))
+            self.write_message(COMMAND_SEND_SCREENSHOT_BYTES)
+    
+    def _queue_decode(self, data: bytes):
+        """Queue a frame for decoding without ever blocking the I/O thread"""
+        if not (data.startswith(b'NUMP') or data.startswith(b'VIDEO')):
+            # JPEG frames are independent, skip them while the decoder is behind
+            if self._decode_q.qsize() < DECODE_BACKLOG_LIMIT:
+                self._decode_q.put_nowait(data)
+            return
+        
+        if self._awaiting_restart:
+            if not self._starts_stream(data):
+                return  # Needs the frames we dropped
+            self._awaiting_restart = False
+        
+        try:
+            self._decode_q.put_nowait(data)
+        except queue.Full:
+            # Numpy and H.264 frames depend on each other, so drop the whole backlog and have the
+            # controllee start over instead of letting latency grow
+            while True:
+                try:
+                    self._decode_q.get_nowait()
+                except queue.Empty:
+                    break
+            self._decode_q.put_nowait(_STREAM_RESTART)
+            self._awaiting_restart = True
+            self.set_value(VAR_RESTART_STREAM, True)
+    
+    @staticmethod
+    def _starts_stream(data: bytes):
+        """Whether a numpy or H.264 frame can be decoded without the frames before it"""
+        if data.startswith(b'NUMPY') and len(data) >= 5 + NUMPY_HEADER.size:
+            return data[4 + NUMPY_HEADER.size] != NUMPY_CODEC_ZLIB  # Codec is the header's last byte
+        # NUMPD needs the canvas; the H.264 decoder was reset and skips ahead to the next keyframe
+        return data.startswith(b'VIDEO')
+    
+    def _decode_worker(self):
+        """Decode and resize frames off the Tk thread"""
+        while self.running:
+            # Block until a frame arrives, stop() wakes us with None
+            data = self._decode_q.get()
+            if data is None:
+                break
+            if data is _STREAM_RESTART:
+                self._zd = None
+                self._h264 = None  # Fresh decoder waits for the restarted stream's keyframe
+                continue
+            
+            try:
+                # Process image data (numpy, H.264 or JPEG)
+                if data.startswith(b'NUMPY'):
+                    img = self._canvas = self.process_numpy_data(data[5:])
+                elif data.startswith(b'NUMPD'):
+                    img = self.process_numpy_delta(data[5:])
+                elif data.startswith(b'VIDEO'):
+                    img = self.process_h264_data(data[5:])
+                else:
+                    img = self.process_jpeg_data(data)
+                
+                new_size = self._label_size
+                if img is not None and new_size[0] > 0 and new_size[1] > 0:
+                    if img.mode != 'RGB':
+                        img = img.convert('RGB')
+                
+                    # Skip the resize copy when the frame already fits the label
+                    if img.size == new_size:
+                        pixels = img.tobytes()
+                    elif CV2_AVAILABLE:
+                        pixels = cv2.resize(np.asarray(img), new_size, interpolation=cv2.INTER_LINEAR).tobytes()  # Same filter as the PIL path
+                    else:
+                        pixels = img.resize(new_size, PIL.Image.BILINEAR).tobytes()
+                
+                    # Binary PPM is parsed by Tk in C, unlike ImageTk's per-row Tcl copy
+                    ppm_data = b'P6\n%d %d\n255\n' % new_size + pixels
+                    self.tk_root.after(0, self.update_image_safe, new_size, ppm_data)
+            except Exception as e:
+                print(f"Decode loop error: {e}")  # Drop this frame, keep decoding
+    
+    def _on_label_configure(self, event):
+        """Track the label size for the decode thread, which can't query Tk"""
+        self._label_size = (event.width, event.height)
     
     def process_numpy_data(self, data: bytes):
-        """Process numpy data with anti-flicker optimization"""
+        """Decode numpy data into a PIL image"""
         try:
-            import PIL.Image
-            from PIL import ImageTk
-            
-            header_size = struct.calcsize('<III')
+            header_size = NUMPY_HEADER.size
             if len(data) < header_size:
-                return
+                return None
             
-            height, width, channels = struct.unpack('<III', data[:header_size])
+            height, width, channels, codec = NUMPY_HEADER.unpack_from(data)
             payload_data = data[header_size:]
             
-            expected_size = height * width * channels
-            
-            if len(payload_data) == expected_size:
+            if codec == NUMPY_CODEC_RAW:
                 array_bytes = payload_data
+            elif codec == NUMPY_CODEC_LZ4:
+                array_bytes = lz4.block.decompress(payload_data, uncompressed_size=height * width * channels)
             else:
-                array_bytes = zlib.decompress(payload_data)
+                if codec == NUMPY_CODEC_ZLIB_RESET:
+                    self._zd = zlib.decompressobj(-15)
+                elif self._zd is None:
+                    return None  # Missed the start of the stream
+                array_bytes = self._zd.decompress(payload_data)
             
-            # Reconstruct numpy array
-            img_array = np.frombuffer(array_bytes, dtype=np.uint8).reshape((height, width, channels))
-            
-            # Convert to PIL and display with anti-flicker
-            img = PIL.Image.fromarray(img_array, 'RGB')
-            new_size = self.get_label_size()
-            if new_size[0] > 0 and new_size[1] > 0:
-                img = img.resize(new_size, PIL.Image.NEAREST)
-                
-                # Anti-flicker: only update if we have a valid image
-                new_image = ImageTk.PhotoImage(img)
-                
-                # Use after_idle to prevent flicker
-                self.tk_root.after_idle(lambda: self.update_image_safe(new_image))
+            # Straight from bytes to PIL
+            return PIL.Image.frombytes('RGB', (width, height), array_bytes)
             
         except Exception as e:
             print(f"Numpy processing error: {e}")
+            return None
+    
+    def process_numpy_delta(self, data: bytes):
+        """Paste a changed numpy region onto the last full frame"""
+        bbox_size = BBOX_HEADER.size
+        if len(data) < bbox_size:
+            return None
+        left, top, right, bottom = BBOX_HEADER.unpack_from(data)
+        # Always decode, the region may continue the deflate stream
+        region = self.process_numpy_data(data[bbox_size:])
+        if region is None or self._canvas is None:
+            return None
+        self._canvas.paste(region, (left, top))
+        return self._canvas
+    
+    def process_h264_data(self, data: bytes):
+        """Decode H.264 packets, returning the newest frame"""
+        try:
+            if self._h264 is None:
+                self._h264 = av.CodecContext.create('h264', 'r')
+            
+            img = None
+            for frame in self._h264.decode(av.Packet(data)):
+                img = frame.to_image()
+            return img
+                    
+        except Exception as e:
+            print(f"H.264 processing error: {e}")
+            return None
     
     def process_jpeg_data(self, data: bytes):
-        """Process JPEG data with anti-flicker optimization"""
+        """Decode JPEG data into a PIL image"""
         try:
-            import PIL.Image
-            from PIL import ImageTk
-            
-            new_size = self.get_label_size()
-            if new_size[0] > 0 and new_size[1] > 0:
-                img = PIL.Image.open(io.BytesIO(data))
-                img = img.resize(new_size, PIL.Image.NEAREST)
-                
-                # Anti-flicker: create image and update safely
-                new_image = ImageTk.PhotoImage(img)
-                
-                # Use after_idle to prevent flicker
-                self.tk_root.after_idle(lambda: self.update_image_safe(new_image))
+            img = PIL.Image.open(io.BytesIO(data))
+            img.load()
+            return img
                 
         except Exception as e:
             print(f"JPEG processing error: {e}")
+            return None
     
-    def update_image_safe(self, new_image):
+    def update_image_safe(self, size, ppm_data):
         """Safely update image to prevent flicker"""
         try:
-            if new_image and hasattr(self, 'label'):
-                # Keep reference to prevent garbage collection
-                self.current_image = new_image
-                self.label.configure(image=self.current_image)
+            if hasattr(self, 'label'):
+                # Only attach a new photo when the frame size changes
+                if (self.current_image.width(), self.current_image.height()) != size:
+                    self.current_image = tkinter.PhotoImage(width=size[0], height=size[1])
+                    self.label.configure(image=self.current_image)
+                self.current_image.tk.call(self.current_image.name, 'put', ppm_data, '-format', 'ppm')
                 # Force update without flickering
                 self.label.update_idletasks()
         except Exception as e:
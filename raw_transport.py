@@ -1,98 +1,355 @@
 """
 High-performance socket-based transport for ultra-low latency
 """
+import os
 import socket
 import threading
-import struct
 import time
 from typing import Callable, Optional
-import queue
+import collections
+import ctypes
+import logging
+import selectors
+import struct
+import sys
+
+HEADER_SIZE = 8  # Little-endian unsigned length prefix, same as Twisted's '<Q'
+RECV_CHUNK = 131072  # 128KB reads for better throughput
+MAX_IOVECS = 128  # Buffers per sendmsg call (64 messages), well under IOV_MAX
+
+# Linux MSG_ZEROCOPY, not exported by the socket module
+SO_ZEROCOPY = 60
+MSG_ZEROCOPY = 0x4000000
+SO_EE_ORIGIN_ZEROCOPY = 5
+SOCK_EXTENDED_ERR = struct.Struct('=IBBBBII')  # struct sock_extended_err from MSG_ERRQUEUE
+ZEROCOPY_THRESHOLD = 16384  # Below this, pinning pages costs more than the copy
+SO_BUSY_POLL = 46  # Linux, not exported by the socket module
+BUSY_POLL_USEC = 50  # Spin this long in the driver before sleeping on a read
+TCP_NOTSENT_LOWAT = getattr(socket, 'TCP_NOTSENT_LOWAT', 25)  # Fallback is the Linux value
+SEND_LOWAT = 131072  # Unsent bytes allowed in the kernel before we stop being writable
+TCP_QUICKACK = getattr(socket, 'TCP_QUICKACK', None)  # Linux only
+TCP_THIN_LINEAR_TIMEOUTS = 16  # Linux, not exported by the socket module
 
-NUM_FORMAT = '<Q'
+# C signature for raw message handlers: (pointer to the message, length)
+RAW_MESSAGE_HANDLER = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_size_t)
+
+# Errors raised on the I/O thread go through logging, so the host app decides where they end up
+logger = logging.getLogger(__name__)
+
+def set_send_lowat(sock):
+    """Bound unsent data in the kernel without capping the window, so SO_SNDBUF can autotune (Linux only)"""
+    if sys.platform.startswith('linux'):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT, SEND_LOWAT)
+        except OSError:
+            pass
+
+def set_thin_stream(sock):
+    """Retransmit sparse input packets on linear instead of exponential backoff (Linux only)"""
+    if sys.platform.startswith('linux'):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, TCP_THIN_LINEAR_TIMEOUTS, 1)
+        except OSError:
+            pass
+
+def set_low_latency_receive(sock):
+    """Busy-poll the NIC where allowed (Linux, needs net.core.busy_poll > 0 for select/epoll)"""
+    if sys.platform.startswith('linux'):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, BUSY_POLL_USEC)
+        except OSError:
+            pass  # Values above net.core.busy_read need CAP_NET_ADMIN
 
 class RawSocketProtocol:
     """Base class for raw socket protocols - much faster than Twisted"""
     
+    io_cpu: Optional[int] = None  # CPU to pin I/O threads to (--io-cpu), ideally the NIC's RX queue CPU
+    
     def __init__(self):
         self.socket = None
         self.running = False
-        self.send_queue = queue.Queue()
-        self.receive_buffer = b''
+        self.send_queue = collections.deque()  # append/popleft are atomic, no lock per message
+        self._wake_recv = self._wake_send = None  # Socketpair that wakes the selector, owned by _io_worker
+        self._wake_pending = False
+        self._zerocopy = False  # MSG_ZEROCOPY enabled on the socket
+        self._zerocopy_seq = 0  # Id the kernel gives the next zerocopy send
+        self._zerocopy_inflight = collections.deque()  # (id, views) kept alive until the kernel is done
+        self.receive_buffer = bytearray(2 * RECV_CHUNK)  # Reused, recv_into writes straight into it
+        self._recv_pos = 0  # Start of the unread data in receive_buffer
+        self._recv_len = 0  # End of the received data in receive_buffer
+        self.unsent_bytes = 0  # Framed bytes the kernel hasn't taken yet, only written by the I/O worker
         self.message_handler: Optional[Callable] = None
+        self.raw_message_handler = None  # RAW_MESSAGE_HANDLER, takes precedence over message_handler
         
     def set_message_handler(self, handler: Callable):
-        """Set function to handle received messages"""
+        """Set function to handle received messages, called with a memoryview that is only valid during the call"""
         self.message_handler = handler
+    
+    def set_raw_message_handler(self, handler):
+        """Set a C-level RAW_MESSAGE_HANDLER, called with a pointer into the receive buffer
+        
+        No bytes object is created per message. The pointer is only valid during the call,
+        the handler must copy anything it keeps.
+        """
+        self.raw_message_handler = handler
         
     def write_message(self, data: bytes):
         """Queue message for sending - ultra fast"""
         if self.running:
-            self.send_queue.put(data, block=False)
+            self.send_queue.append(data)
+            self._wake()
     
-    def _send_worker(self):
-        """High-performance send worker thread"""
-        while self.running:
+    def write_message_parts(self, *parts):
+        """Queue a message built from several parts, framed in one buffer with a single copy"""
+        if not self.running:
+            return
+        views = [memoryview(part).cast('B') for part in parts]
+        message_length = sum(view.nbytes for view in views)
+        
+        # Length prefix and parts go into one preallocated buffer, so the send worker
+        # doesn't need to concatenate again
+        framed = bytearray(HEADER_SIZE + message_length)
+        framed[:HEADER_SIZE] = message_length.to_bytes(HEADER_SIZE, 'little')
+        offset = HEADER_SIZE
+        for view in views:
+            framed[offset:offset + view.nbytes] = view
+            offset += view.nbytes
+        self.send_queue.append([memoryview(framed)])  # A list marks it as already framed
+        self._wake()
+    
+    def write_message_iov(self, *parts):
+        """Queue a message as separate buffers for one sendmsg, no copy; parts must not change until the
+        kernel is done with them (zerocopy completion, _zerocopy_inflight holds the reference until then)"""
+        if not self.running:
+            return
+        views = [memoryview(part).cast('B') for part in parts]
+        message_length = sum(view.nbytes for view in views)
+        views.insert(0, memoryview(message_length.to_bytes(HEADER_SIZE, 'little')))
+        self.send_queue.append(views)
+        self._wake()
+    
+    def _wake(self):
+        """Interrupt the selector so the I/O worker picks up newly queued messages"""
+        wake_send = self._wake_send
+        if not self._wake_pending and wake_send is not None:
+            self._wake_pending = True
             try:
-                # Get message with ultra-minimal timeout for maximum responsiveness  
-                data = self.send_queue.get(timeout=0.0001)  # 0.1ms timeout
-                if data is None:  # Shutdown signal
-                    break
-                    
-                # Send with length prefix (same format as Twisted version)
-                message_length = struct.pack(NUM_FORMAT, len(data))
-                self.socket.sendall(message_length + data)
-                
-            except queue.Empty:
-                continue
-            except Exception as e:
-                if self.running:
-                    print(f"Send error: {e}")
-                break
+                wake_send.send(b'\0')
+            except OSError:
+                pass  # Worker already gone
     
-    def _receive_worker(self):
-        """High-performance receive worker thread"""
-        while self.running:
+    def _io_worker(self):
+        """Single event-loop thread per connection: reads and writes multiplexed with a selector"""
+        self.socket.setblocking(False)
+        if self.io_cpu is not None:
+            self._pin_to_cpu(self.io_cpu)
+        if sys.platform.startswith('linux'):
             try:
-                # Receive data with larger buffer for less overhead
-                data = self.socket.recv(131072)  # 128KB chunks for better throughput
-                if not data:
-                    break
-                    
-                self.receive_buffer += data
-                self._process_messages()
+                self.socket.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+                self._zerocopy = True
+            except OSError:
+                pass  # Kernel older than 4.14
+        # Created here so only connections that run an I/O loop hold one; the first byte makes the
+        # loop drain anything queued before the pair existed
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_pending = True
+        self._wake_send.send(b'\0')
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        selector.register(self._wake_recv, selectors.EVENT_READ)
+        pending = []  # Unsent views, only non-empty while the kernel send buffer is full
+        want_write = False
+        # Hot lookups as locals, the loop runs once per wakeup
+        sock = self.socket
+        wake_recv = self._wake_recv
+        send_queue = self.send_queue
+        popleft = send_queue.popleft
+        append = pending.append
+        select = selector.select
+        read_ready = self._read_ready
+        write_ready = self._write_ready
+        try:
+            while self.running:
+                for key, events in select():
+                    if key.fileobj is wake_recv:
+                        # Clear the flag before draining so a concurrent write_message wakes us again
+                        wake_recv.recv(4096)
+                        self._wake_pending = False
+                    elif events & selectors.EVENT_READ:
+                        if not read_ready():
+                            return
                 
-            except Exception as e:
-                if self.running:
-                    print(f"Receive error: {e}")
-                break
+                # Drain whatever is queued (e.g. MoveMouse + MouseInput) into the same write
+                while send_queue:
+                    data = popleft()
+                    if isinstance(data, list):
+                        pending.extend(data)  # write_message_parts/_iov, already framed
+                        continue
+                    view = memoryview(data).cast('B')
+                    # Length prefix (same format as Twisted version)
+                    append(memoryview(view.nbytes.to_bytes(HEADER_SIZE, 'little')))
+                    append(view)
+                if pending:
+                    write_ready(pending)
+                self.unsent_bytes = sum(view.nbytes for view in pending)
+                if self._zerocopy_inflight:
+                    self._reap_zerocopy()
+                
+                # Only wait for writability while the kernel still has to take some of our data
+                if want_write != bool(pending):
+                    want_write = bool(pending)
+                    selector.modify(sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if want_write else 0))
+                
+        except Exception as e:
+            if self.running:
+                logger.error("Connection error: %s", e)
+        finally:
+            selector.close()
+            wake_send, self._wake_send = self._wake_send, None
+            wake_send.close()
+            wake_recv.close()
+    
+    def _pin_to_cpu(self, cpu):
+        """Pin this thread to one CPU (Linux only); steer the NIC's RX queue there with ethtool -X and IRQ affinity"""
+        if not hasattr(os, 'sched_setaffinity'):
+            logger.warning("--io-cpu is only supported on Linux")
+            return
+        try:
+            os.sched_setaffinity(0, {cpu})  # 0 is the calling thread
+        except OSError as e:
+            logger.error("Could not pin I/O to CPU %s: %s", cpu, e)
+    
+    def _write_ready(self, pending):
+        """Send as much of pending as the kernel accepts, one vectored syscall at a time"""
+        while pending:
+            try:
+                if hasattr(self.socket, 'sendmsg'):
+                    batch = pending[:MAX_IOVECS]
+                    if self._zerocopy and sum(view.nbytes for view in batch) >= ZEROCOPY_THRESHOLD:
+                        sent = self._send_zerocopy(batch)
+                    else:
+                        sent = self.socket.sendmsg(batch)
+                else:
+                    # Windows sockets have no sendmsg
+                    sent = self.socket.send(pending[0])
+            except BlockingIOError:
+                return
+            # Drop fully sent parts and trim a partially sent one
+            while pending and sent >= pending[0].nbytes:
+                sent -= pending[0].nbytes
+                pending.pop(0)
+            if pending and sent:
+                pending[0] = pending[0][sent:]
+    
+    def _send_zerocopy(self, batch):
+        """sendmsg with MSG_ZEROCOPY, the kernel reads the pages directly instead of copying them"""
+        try:
+            sent = self.socket.sendmsg(batch, [], MSG_ZEROCOPY)
+        except BlockingIOError:
+            raise
+        except OSError:
+            # ENOBUFS: too many pinned pages in flight, fall back to a copying send
+            return self.socket.sendmsg(batch)
+        # The buffers must stay alive and unchanged until the kernel reports completion
+        self._zerocopy_inflight.append((self._zerocopy_seq, batch))
+        self._zerocopy_seq = (self._zerocopy_seq + 1) & 0xFFFFFFFF
+        return sent
+    
+    def _reap_zerocopy(self):
+        """Release buffers of zerocopy sends the kernel reported as completed on the error queue"""
+        while self._zerocopy_inflight:
+            try:
+                _, ancdata, _, _ = self.socket.recvmsg(0, 1024, socket.MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            for _, _, cmsg_data in ancdata:
+                # struct sock_extended_err: errno, origin, type, code, pad, info, data
+                if len(cmsg_data) < SOCK_EXTENDED_ERR.size:
+                    continue
+                _, origin, _, _, _, first, last = SOCK_EXTENDED_ERR.unpack_from(cmsg_data)
+                if origin != SO_EE_ORIGIN_ZEROCOPY:
+                    continue
+                # Sends first..last completed, ids complete in order
+                while self._zerocopy_inflight and ((last - self._zerocopy_inflight[0][0]) & 0xFFFFFFFF) < 0x80000000:
+                    self._zerocopy_inflight.popleft()
+    
+    def _read_ready(self):
+        """Read what's available into the reusable buffer, False once the peer closed"""
+        # Grow only when the free space can't take a full chunk (large frames)
+        if len(self.receive_buffer) - self._recv_len < RECV_CHUNK:
+            self.receive_buffer.extend(bytes(len(self.receive_buffer)))
+        
+        # Receive directly into the reusable buffer, no per-read bytes object
+        try:
+            with memoryview(self.receive_buffer) as view:
+                received = self.socket.recv_into(view[self._recv_len:])
+        except BlockingIOError:
+            return True
+        if not received:
+            return False
+        if TCP_QUICKACK is not None:
+            # The kernel drops back to delayed ACKs after each ACK, so re-arm on every read
+            try:
+                self.socket.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+            except OSError:
+                pass
+        
+        self._recv_len += received
+        self._process_messages()
+        return True
     
     def _process_messages(self):
         """Process complete messages from buffer"""
-        header_size = struct.calcsize(NUM_FORMAT)
-        
-        while len(self.receive_buffer) >= header_size:
+        buffer = self.receive_buffer
+        handler = self.message_handler
+        raw_handler = self.raw_message_handler
+        pos = self._recv_pos
+        end = self._recv_len
+        while end - pos >= HEADER_SIZE:
             # Get message length
-            message_length = struct.unpack(NUM_FORMAT, self.receive_buffer[:header_size])[0]
-            total_length = header_size + message_length
+            start = pos
+            message_length = int.from_bytes(buffer[start:start + HEADER_SIZE], 'little')
+            total_length = HEADER_SIZE + message_length
             
             # Check if we have complete message
-            if len(self.receive_buffer) >= total_length:
-                # Extract message
-                message_data = self.receive_buffer[header_size:total_length]
-                self.receive_buffer = self.receive_buffer[total_length:]
+            if end - start >= total_length:
+                pos = start + total_length
                 
-                # Handle message
-                if self.message_handler:
+                if raw_handler:
+                    # Hand the message to C in place, no copy
+                    message = (ctypes.c_char * message_length).from_buffer(buffer, start + HEADER_SIZE)
                     try:
-                        self.message_handler(message_data)
+                        raw_handler(ctypes.addressof(message), message_length)
                     except Exception as e:
-                        print(f"Message handler error: {e}")
+                        logger.error("Message handler error: %s", e)
+                    del message  # Release the export so the buffer can be compacted
+                    continue
+                
+                # Handle the message in place, handlers copy whatever they keep
+                if handler:
+                    with memoryview(buffer) as view, view[start + HEADER_SIZE:pos] as message_data:
+                        try:
+                            handler(message_data)
+                        except Exception as e:
+                            logger.error("Message handler error: %s", e)
             else:
                 break
+        
+        # Compact once the consumed prefix outweighs the unread tail, amortized O(1) per byte
+        if pos == end:
+            pos = end = 0
+        elif pos > end // 2:
+            remaining = end - pos
+            buffer[:remaining] = buffer[pos:end]
+            pos = 0
+            end = remaining
+        self._recv_pos = pos
+        self._recv_len = end
     
     def stop(self):
         """Stop the protocol"""
         self.running = False
+        self._wake()  # Let the I/O worker see running is False
         if self.socket:
             try:
                 self.socket.close()
@@ -112,13 +369,20 @@ class RawSocketServer(RawSocketProtocol):
         
     def start(self):
         """Start the server"""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Dual-stack where supported, so both IPv4 and IPv6 controllers can connect
+        if socket.has_dualstack_ipv6():
+            self.server_socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            bind_address = ('::', self.port)
+        else:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            bind_address = ('0.0.0.0', self.port)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
         # Ultra-low latency socket options
         self.server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         
-        self.server_socket.bind(('0.0.0.0', self.port))
+        self.server_socket.bind(bind_address)
         self.server_socket.listen(1)
         
         print(f"Raw socket server listening on port {self.port}")
@@ -135,8 +399,9 @@ class RawSocketServer(RawSocketProtocol):
                 
                 # Ultra-aggressive socket optimization for minimum latency
                 client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # No Nagle
-                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 524288)  # 512KB send buffer
-                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 524288)  # 512KB receive buffer
+                set_send_lowat(client_socket)
+                set_low_latency_receive(client_socket)
+                set_thin_stream(client_socket)
                 
                 # Additional low-latency optimizations
                 try:
@@ -144,9 +409,6 @@ class RawSocketServer(RawSocketProtocol):
                 except (AttributeError, OSError):
                     pass  # Not available on all platforms
                 
-                # Set socket to non-blocking for faster operations
-                client_socket.setblocking(True)  # Keep blocking for simplicity but optimize
-                
                 # Create protocol instance
                 if callable(self.protocol_class):
                     if self.protocol_args:
@@ -160,9 +422,8 @@ class RawSocketServer(RawSocketProtocol):
                 self.client_protocol.socket = client_socket
                 self.client_protocol.running = True
                 
-                # Start worker threads
-                threading.Thread(target=self.client_protocol._send_worker, daemon=True).start()
-                threading.Thread(target=self.client_protocol._receive_worker, daemon=True).start()
+                # One event-loop thread handles both directions
+                threading.Thread(target=self.client_protocol._io_worker, daemon=True).start()
                 
                 # Protocol-specific initialization
                 if hasattr(self.client_protocol, 'connection_made'):
@@ -171,7 +432,7 @@ class RawSocketServer(RawSocketProtocol):
                 break  # Only handle one client for simplicity
                 
             except Exception as e:
-                print(f"Accept error: {e}")
+                logger.error("Accept error: %s", e)
                 break
 
 class RawSocketClient(RawSocketProtocol):
@@ -185,23 +446,38 @@ class RawSocketClient(RawSocketProtocol):
         self.protocol_args = protocol_args or []
         self.protocol_instance = None
         
-    def connect(self):
-        """Connect to server"""
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def _open_socket(self, family):
+        """Create a client socket for the given address family, tuned before connecting"""
+        sock = socket.socket(family, socket.SOCK_STREAM)
         
         # Ultra-aggressive client socket optimization
-        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # No Nagle
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 524288)  # 512KB send buffer  
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 524288)  # 512KB receive buffer
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # No Nagle
+        set_send_lowat(sock)
+        set_low_latency_receive(sock)
+        set_thin_stream(sock)
         
         # Additional low-latency optimizations
         try:
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)  # Quick ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)  # Quick ACK
         except (AttributeError, OSError):
             pass  # Not available on all platforms
-        
+        return sock
+    
+    def connect(self):
+        """Connect to server"""
         try:
-            self.socket.connect((self.host, self.port))
+            # Try every resolved address (IPv6 and IPv4) in the resolver's order
+            last_error = None
+            for family, _, _, _, address in socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM):
+                self.socket = self._open_socket(family)
+                try:
+                    self.socket.connect(address)
+                    break
+                except OSError as e:
+                    self.socket.close()
+                    last_error = e
+            else:
+                raise last_error or OSError(f"Could not resolve {self.host}")
             print(f"Raw socket connected to {self.host}:{self.port}")
             
             # Create protocol instance
@@ -217,9 +493,8 @@ class RawSocketClient(RawSocketProtocol):
             self.protocol_instance.socket = self.socket
             self.protocol_instance.running = True
             
-            # Start worker threads
-            threading.Thread(target=self.protocol_instance._send_worker, daemon=True).start()
-            threading.Thread(target=self.protocol_instance._receive_worker, daemon=True).start()
+            # One event-loop thread handles both directions
+            threading.Thread(target=self.protocol_instance._io_worker, daemon=True).start()
             
             # Protocol-specific initialization
             if hasattr(self.protocol_instance, 'connection_made'):
@@ -228,7 +503,7 @@ class RawSocketClient(RawSocketProtocol):
             return self.protocol_instance
             
         except Exception as e:
-            print(f"Connection error: {e}")
+            logger.error("Connection error: %s", e)
             return None
 
 # Factory functions to match the existing interface